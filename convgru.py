@@ -2,8 +2,195 @@ import torch
 import torch.nn as nn
 import torch.nn.init as init
 import torch.nn.functional as functional
+from torch.nn.modules.utils import _pair
 from typing import Union
 
+# ------------------------------------------------------------------------------
+# Gated Recurrent Unit equations
+# ------------------------------------------------------------------------------
+
+
+@torch.jit.script
+def _n_branch(ih_n: torch.Tensor, hh_n: torch.Tensor, 
+              r: torch.Tensor) -> torch.Tensor:
+    """
+    Compute the new gate tanh(ih_n + r * hh_n) as a single multiply-add, so
+    that r * hh_n is not materialized before the addition.
+    """
+    return torch.tanh(ih_n.addcmul(r, hh_n))
+
+
+@torch.jit.script
+def _gru_gate(ih: torch.Tensor, hh: torch.Tensor, hx: torch.Tensor, 
+              hidden_channels: int) -> torch.Tensor:
+    """
+    Apply the Gated Recurrent Unit equations to the convolution outputs.
+
+    The input-to-hidden and hidden-to-hidden outputs hold the update, reset
+    and new gates stacked along the channel dimension. Scripting the function
+    lets TorchScript fuse the pointwise operations into a single kernel
+    instead of launching one per operation.
+
+    Arguments:
+        ih {torch.Tensor} -- [Output of the input-to-hidden convolution]
+        hh {torch.Tensor} -- [Output of the hidden-to-hidden convolution]
+        hx {torch.Tensor} -- [Previous hidden state]
+        hidden_channels {int} -- [Number of channels of the hidden state]
+
+    Returns:
+        torch.Tensor -- [Next hidden state]
+    """
+    # Add the update and reset pre-activations in one go, then split them
+    z, r = torch.sigmoid(ih[:, :2*hidden_channels] + 
+                         hh[:, :2*hidden_channels]).chunk(2, dim=1)
+    n = _n_branch(ih[:, 2*hidden_channels:], hh[:, 2*hidden_channels:], r)
+    # Blend as (1 - z) * n + z * hx in a single pass, in the precision of n,
+    # then keep the recurrence in the precision of the convolutions
+    return torch.lerp(n, hx.to(n.dtype), z.to(n.dtype)).to(ih.dtype)
+
+
+@torch.jit.script
+def _fused_gru_gate(gates: torch.Tensor, hx: torch.Tensor, 
+                    hidden_channels: int) -> torch.Tensor:
+    """
+    Apply the Gated Recurrent Unit equations to the fused convolution output.
+
+    The fused output holds the summed update and reset pre-activations,
+    followed by the input-to-hidden and hidden-to-hidden parts of the new
+    gate, which have to stay separate for the reset gate to apply.
+
+    Arguments:
+        gates {torch.Tensor} -- [Output of the fused convolution]
+        hx {torch.Tensor} -- [Previous hidden state]
+        hidden_channels {int} -- [Number of channels of the hidden state]
+
+    Returns:
+        torch.Tensor -- [Next hidden state]
+    """
+    z, r = torch.sigmoid(gates[:, :2*hidden_channels]).chunk(2, dim=1)
+    n = _n_branch(gates[:, 2*hidden_channels:3*hidden_channels], 
+                  gates[:, 3*hidden_channels:], r)
+    # Blend as (1 - z) * n + z * hx in a single pass, in the precision of n,
+    # then keep the recurrence in the precision of the convolution
+    return torch.lerp(n, hx.to(n.dtype), z.to(n.dtype)).to(gates.dtype)
+
+
+def _can_fuse(conv_ih: nn.Module, conv_hh: nn.Module) -> bool:
+    """
+    Check whether both convolutions should run as a single one on the
+    concatenation of the input and the hidden state, which requires them to
+    share the same unit-stride geometry.
+
+    Keeping the reset gate apart makes the fused convolution a third larger
+    than the two separate ones, a quarter of its weight being zeros, so it
+    only pays off for narrow cells where the saved kernel launch dominates.
+    """
+    return (conv_ih.in_channels <= 8 and conv_hh.in_channels <= 8 and 
+            all(stride == 1 for stride in conv_ih.stride) and 
+            conv_ih.kernel_size == conv_hh.kernel_size and 
+            conv_ih.padding == conv_hh.padding and 
+            conv_ih.dilation == conv_hh.dilation)
+
+
+def _fused_parameters(conv_ih: nn.Module, conv_hh: nn.Module, 
+                      hidden_channels: int):
+    """
+    Build the weight and bias of the fused convolution from the
+    input-to-hidden and hidden-to-hidden ones.
+
+    The update and reset gates read both the input and the hidden state, while
+    the new gate is split in two output blocks, one for each, padded with
+    zeros. The parameters are rebuilt on every call so that gradients flow back
+    to the original convolutions.
+    """
+    w_ih, w_hh = conv_ih.weight, conv_hh.weight
+    b_ih, b_hh = conv_ih.bias, conv_hh.bias
+    zr = 2 * hidden_channels
+    weight = torch.cat([
+        torch.cat([w_ih[:zr], w_hh[:zr]], dim=1),
+        torch.cat([w_ih[zr:], w_hh.new_zeros(w_hh[zr:].size())], dim=1),
+        torch.cat([w_ih.new_zeros(w_ih[zr:].size()), w_hh[zr:]], dim=1)])
+    bias = torch.cat([b_ih[:zr] + b_hh[:zr], b_ih[zr:], b_hh[zr:]])
+    return weight, bias
+
+
+def _separable_conv(conv: type, in_channels: int, out_channels: int, 
+                    kernel_size, stride, padding) -> nn.Sequential:
+    """
+    Build a depthwise-separable convolution, that is a depthwise convolution
+    holding the spatial kernel followed by a pointwise one mixing the channels.
+    """
+    return nn.Sequential(
+        conv(in_channels, in_channels, kernel_size, stride=stride, 
+             padding=padding, groups=in_channels, bias=False),
+        conv(in_channels, out_channels, 1))
+
+
+def _graph_signature(input: torch.Tensor, hx: torch.Tensor):
+    """
+    Describe what a step captured into a CUDA graph depends on besides the 
+    parameters, that is the shapes, dtypes and devices of the tensors, the 
+    memory format of the input, which the hidden state is returned in, and the
+    autocast state, which sets the precision the step runs in.
+    """
+    device_type = input.device.type
+    channels_last = (input.dim() == 4 and 
+                     input.is_contiguous(memory_format=torch.channels_last))
+    return (input.size(), input.dtype, input.device, channels_last, 
+            hx.size(), hx.dtype, hx.device, 
+            torch.is_autocast_enabled(device_type), 
+            torch.get_autocast_dtype(device_type))
+
+
+def _capture_graph(cell: nn.Module, input: torch.Tensor, hx: torch.Tensor, 
+                   warmup: int):
+    """
+    Capture a step of the cell into a CUDA graph, reading its input and hidden
+    state from static buffers and writing its output to a static one.
+    """
+    cell._static_in, cell._static_hx = input.clone(), hx.clone()
+    cell._static_signature = _graph_signature(input, hx)
+    # Warm up on a side stream, as required before capturing
+    stream = torch.cuda.Stream(device=input.device)
+    stream.wait_stream(torch.cuda.current_stream(input.device))
+    with torch.no_grad(), torch.cuda.stream(stream):
+        for _ in range(warmup):
+            cell._forward_impl(cell._static_in, cell._static_hx)
+    torch.cuda.current_stream(input.device).wait_stream(stream)
+    cell._graph = torch.cuda.CUDAGraph()
+    with torch.no_grad(), torch.cuda.graph(cell._graph):
+        cell._static_out = cell._forward_impl(cell._static_in, cell._static_hx)
+
+
+def _release_graph(cell: nn.Module):
+    """
+    Forget the CUDA graph captured for the cell along with its static buffers.
+    """
+    cell._graph = cell._static_signature = None
+    cell._static_in = cell._static_hx = cell._static_out = None
+
+
+def _replay_graph(cell: nn.Module, input: torch.Tensor, hx: torch.Tensor):
+    """
+    Replay the CUDA graph captured for the cell if the call matches it, that 
+    is if no gradient is required and the call has the captured signature. 
+    Returns None otherwise, to fall back to eager mode.
+    """
+    if torch.is_grad_enabled():
+        return None
+    # A missing hidden state is replayed as zeros in the captured buffer
+    signature = _graph_signature(input, cell._static_hx if hx is None else hx)
+    if signature != cell._static_signature:
+        return None
+    cell._static_in.copy_(input)
+    if hx is None:
+        cell._static_hx.zero_()
+    else:
+        cell._static_hx.copy_(hx)
+    cell._graph.replay()
+    # The static output is overwritten by the next replay
+    return cell._static_out.clone()
+
 # ------------------------------------------------------------------------------
 # One-dimensional Convolution Gated Recurrent Unit
 # ------------------------------------------------------------------------------
@@ -17,7 +204,8 @@ class ConvGRU1DCell(nn.Module):
     
     def __init__(self, input_channels: int, hidden_channels: int, 
                  kernel_size: int, stride: int=1, padding: int=0,
-                 recurrent_kernel_size: int=3):
+                 recurrent_kernel_size: int=3, separable: bool=False,
+                 compiled: bool=False):
         """
         One-Dimensional Convolutional Gated Recurrent Unit (ConvGRU1D) cell.
 
@@ -26,8 +214,26 @@ class ConvGRU1DCell(nn.Module):
         convolution kernel is forced to be unit-stride, with a padding assuming
         an odd kernel size, in order to keep the number of features the same.
         
+        When the input-to-hidden convolution is unit-stride and shares the
+        kernel size and padding of the hidden-to-hidden one, both run as a 
+        single convolution on the concatenation of the input and hidden state,
+        as long as neither has more than 8 channels. Wider cells run faster
+        with two convolutions, the fused one computing a block of zeros to
+        keep the reset gate apart.
+
+        With separable set, both convolutions are factorized into a depthwise
+        convolution followed by a pointwise one, which cuts their parameters
+        and multiply-accumulates by roughly the kernel size.
+
+        With compiled set, the step is compiled with torch.compile for static
+        shapes the first time it runs, letting Inductor fuse the gating into 
+        the convolution epilogue. Changing the input shape triggers a 
+        recompilation.
+
         The hidden state is initialized by default to a zero tensor of the
-        appropriate shape.
+        appropriate shape. Under torch.autocast, the hidden state follows the 
+        half precision of the convolution outputs, while the parameters stay 
+        in single precision and are cast on demand.
 
         Arguments:
             input_channels {int} -- [Number of channels of the input tensor]
@@ -41,48 +247,265 @@ class ConvGRU1DCell(nn.Module):
                               (default: {0})
             recurrent_kernel_size {int} -- [Size of the hidden-to-hidden 
                                             convolving kernel] (default: {3})
+            separable {bool} -- [Use depthwise-separable convolutions] 
+                                 (default: {False})
+            compiled {bool} -- [Compile the step with torch.compile on first
+                                use] (default: {False})
         """
         super(ConvGRU1DCell, self).__init__()
         
-        self.conv_ih = nn.Conv1d(input_channels, hidden_channels * 3, 
-                                 kernel_size, stride=stride, padding=padding)
-        self.conv_hh = nn.Conv1d(hidden_channels, hidden_channels * 3, 
-                                 recurrent_kernel_size, stride=1, 
-                                 padding=recurrent_kernel_size // 2)
+        if separable:
+            self.conv_ih = _separable_conv(nn.Conv1d, input_channels, 
+                                           hidden_channels * 3, kernel_size, 
+                                           stride, padding)
+            self.conv_hh = _separable_conv(nn.Conv1d, hidden_channels, 
+                                           hidden_channels * 3, 
+                                           recurrent_kernel_size, 1, 
+                                           recurrent_kernel_size // 2)
+        else:
+            self.conv_ih = nn.Conv1d(input_channels, hidden_channels * 3, 
+                                     kernel_size, stride=stride, 
+                                     padding=padding)
+            self.conv_hh = nn.Conv1d(hidden_channels, hidden_channels * 3, 
+                                     recurrent_kernel_size, stride=1, 
+                                     padding=recurrent_kernel_size // 2)
         self.h_channels = hidden_channels
+        self.separable = separable
+        self.fused = not separable and _can_fuse(self.conv_ih, self.conv_hh)
+        self.compiled = compiled
+        self._compiled_forward = None
+        _release_graph(self)
+        # Cache the input-to-hidden geometry used to size the hidden state
+        conv_ih = self.conv_ih[0] if separable else self.conv_ih
+        self._k0, self._p0, self._s0 = \
+            conv_ih.kernel_size[0], conv_ih.padding[0], conv_ih.stride[0]
     
         self.reset_parameters()
 
     def reset_parameters(self):
-        init.orthogonal_(self.conv_hh.weight)
-        init.xavier_uniform_(self.conv_ih.weight)
-        init.zeros_(self.conv_hh.bias)
-        init.zeros_(self.conv_ih.bias)
+        if self.separable:
+            for conv in (self.conv_ih, self.conv_hh):
+                init.orthogonal_(conv[0].weight)
+                init.xavier_uniform_(conv[1].weight)
+                init.zeros_(conv[1].bias)
+        else:
+            init.orthogonal_(self.conv_hh.weight)
+            init.xavier_uniform_(self.conv_ih.weight)
+            init.zeros_(self.conv_hh.bias)
+            init.zeros_(self.conv_ih.bias)
+
+    def __getstate__(self):
+        # The compiled step and the captured graph hold on to this instance, 
+        # so copies and pickles drop them and rebuild their own
+        state = super(ConvGRU1DCell, self).__getstate__()
+        state.update(_compiled_forward=None, _graph=None, _static_in=None, 
+                     _static_hx=None, _static_out=None, 
+                     _static_signature=None)
+        return state
+
+    def _apply(self, fn, *args, **kwargs):
+        # Moving or casting the parameters invalidates the captured graph
+        _release_graph(self)
+        return super(ConvGRU1DCell, self)._apply(fn, *args, **kwargs)
 
     # --------------------------------------------------------------------------
     # Processing
     # --------------------------------------------------------------------------
     
+    def capture(self, input, hx, warmup: int=3):
+        """
+        Capture the step into a CUDA graph, replayed by the following calls
+        to get rid of the kernel launch overhead.
+
+        The graph is only replayed for inference calls, with gradients
+        disabled, whose input and hidden state match the shapes, dtypes and
+        devices of the ones given here, with the same torch.autocast state as
+        during the capture. Any other call, for instance with a different 
+        batch size, falls back to eager execution.
+
+        The graph reads the parameters from their current storage. Moving or
+        casting the cell, e.g. with .to(), drops the graph, while in-place 
+        updates such as optimizer steps or load_state_dict() are picked up.
+        Assigning new tensors to the parameters is not detected, so capture
+        again afterwards. Copies and pickles of the cell do not keep the graph.
+
+        Arguments:
+            input {torch.Tensor} -- [Example input on a CUDA device]
+            hx {torch.Tensor} -- [Example hidden state on a CUDA device]
+
+        Keyword Arguments:
+            warmup {int} -- [Number of eager steps run before capturing] 
+                             (default: {3})
+        """
+        _capture_graph(self, input, hx, warmup)
+
     def forward(self, input, hx=None):
-        output_size = \
-            int((input.size(-1) - self.conv_ih.kernel_size[0] + 
-                 2 * self.conv_ih.padding[0]) / self.conv_ih.stride[0]) + 1
+        # Replay the captured CUDA graph when the call matches it
+        if self._graph is not None:
+            output = _replay_graph(self, input, hx)
+            if output is not None:
+                return output
+        # Compile the step lazily on first use, as shapes are static
+        if self.compiled:
+            if self._compiled_forward is None:
+                self._compiled_forward = torch.compile(
+                    type(self)._forward_impl, dynamic=False)
+            return self._compiled_forward(self, input, hx)
+        return self._forward_impl(input, hx)
+
+    def _forward_impl(self, input, hx=None):
+        output_size = (input.size(-1) - self._k0 + 2 * self._p0) // self._s0 + 1
+        # Handle the case of no hidden state provided
+        if hx is None:
+            hx = input.new_zeros((input.size(0), self.h_channels, 
+                                  output_size))
+        # Run both convolutions as a single kernel when their geometry matches
+        if self.fused:
+            weight, bias = _fused_parameters(self.conv_ih, self.conv_hh, 
+                                             self.h_channels)
+            gates = functional.conv1d(torch.cat([input, hx], dim=1), weight, 
+                                      bias, padding=self.conv_hh.padding)
+            return _fused_gru_gate(gates, hx, self.h_channels)
+        # Run the input->hidden and hidden->hidden convolution kernels, going
+        # through the functional API to skip the module call machinery
+        if self.separable:
+            ih_conv_output = self.conv_ih(input)
+            hh_conv_output = self.conv_hh(hx)
+        else:
+            ih_conv_output = functional.conv1d(input, self.conv_ih.weight, 
+                                               self.conv_ih.bias, 
+                                               stride=self._s0, 
+                                               padding=self._p0)
+            hh_conv_output = functional.conv1d(hx, self.conv_hh.weight, 
+                                               self.conv_hh.bias, 
+                                               padding=self.conv_hh.padding)
+        # Apply the fused Gated Recurrent Unit equations
+        return _gru_gate(ih_conv_output, hh_conv_output, hx, self.h_channels)
+
+
+class ConvGRU1D(nn.Module):
+
+    # --------------------------------------------------------------------------
+    # Initialization
+    # --------------------------------------------------------------------------
+    
+    def __init__(self, input_channels: int, hidden_channels: int, 
+                 kernel_size: int, stride: int=1, padding: int=0,
+                 recurrent_kernel_size: int=3, separable: bool=False,
+                 batch_first: bool=False, nb_layers: int=1):
+        """
+        One-Dimensional Convolutional Gated Recurrent Unit (ConvGRU1D) layer.
+
+        Runs a stack of ConvGRU1DCell over a whole sequence. The 
+        input-to-hidden convolution does not depend on the hidden state, so it
+        is computed for all the time steps at once by folding time into the 
+        batch dimension, leaving only the hidden-to-hidden convolution and the
+        gating inside the time loop.
+
+        The first layer uses the given input-to-hidden kernel. The following 
+        layers read the hidden states of the previous one with a unit-stride
+        kernel of size recurrent_kernel_size, which keeps the number of 
+        features the same.
+
+        Arguments:
+            input_channels {int} -- [Number of channels of the input tensor]
+            hidden_channels {int} -- [Number of channels of the hidden state]
+            kernel_size {int} -- [Size of the input-to-hidden convolving kernel]
+        
+        Keyword Arguments:
+            stride {int} -- [Stride of the input-to-hidden convolution] 
+                             (default: {1})
+            padding {int} -- [Zero-padding added to both sides of the input] 
+                              (default: {0})
+            recurrent_kernel_size {int} -- [Size of the hidden-to-hidden 
+                                            convolving kernel] (default: {3})
+            separable {bool} -- [Use depthwise-separable convolutions] 
+                                 (default: {False})
+            batch_first {bool} -- [Expect (B, T, C, L) sequences instead of 
+                                   (T, B, C, L)] (default: {False})
+            nb_layers {int} -- [Number of stacked recurrent layers] 
+                                (default: {1})
+        """
+        super(ConvGRU1D, self).__init__()
+
+        if nb_layers < 1:
+            raise ValueError(
+                "nb_layers should be at least 1, got {0}".format(nb_layers))
+        self.cells = nn.ModuleList([
+            ConvGRU1DCell(input_channels, hidden_channels, kernel_size, 
+                          stride=stride, padding=padding, 
+                          recurrent_kernel_size=recurrent_kernel_size,
+                          separable=separable)])
+        for _ in range(nb_layers - 1):
+            self.cells.append(
+                ConvGRU1DCell(hidden_channels, hidden_channels, 
+                              recurrent_kernel_size, 
+                              padding=recurrent_kernel_size // 2, 
+                              recurrent_kernel_size=recurrent_kernel_size,
+                              separable=separable))
+        self.batch_first = batch_first
+        self.nb_layers = nb_layers
+
+    def reset_parameters(self):
+        for cell in self.cells:
+            cell.reset_parameters()
+
+    # --------------------------------------------------------------------------
+    # Processing
+    # --------------------------------------------------------------------------
+    
+    def forward(self, input, hx=None):
+        """
+        Arguments:
+            input {torch.Tensor} -- [Input sequence of shape (T, B, C, L), or
+                                     (B, T, C, L) if batch_first]
+        
+        Keyword Arguments:
+            hx {torch.Tensor} -- [Initial hidden states of shape 
+                                  (nb_layers, B, H, L)] (default: {None})
+        
+        Returns:
+            tuple -- [Hidden states of the last layer for every time step, and
+                      hidden states of every layer for the last time step]
+        """
+        time_dim = 1 if self.batch_first else 0
+        output = input
+        h_n = []
+        for layer, cell in enumerate(self.cells):
+            output = self._run_layer(cell, output, 
+                                     None if hx is None else hx[layer], 
+                                     time_dim)
+            h_n.append(output.select(time_dim, -1))
+        return output, torch.stack(h_n)
+
+    def _run_layer(self, cell, input, hx, time_dim):
+        batch = input.size(1 - time_dim)
+        # Run the input->hidden convolution over all the time steps at once
+        ih_conv_output = cell.conv_ih(input.flatten(0, 1))
+        ih_conv_output = ih_conv_output.view(input.size()[:2] + 
+                                             ih_conv_output.size()[1:])
         # Handle the case of no hidden state provided
         if hx is None:
-            hx = torch.zeros(input.size(0), self.h_channels, output_size, 
-                             device=input.device)
-        # Run the input->hidden and hidden->hidden convolution kernels
-        ih_conv_output = self.conv_ih(input)
-        hh_conv_output = self.conv_hh(hx)
-        # Separate the results and apply Gated Recurrent Unit equations
-        z = torch.sigmoid(ih_conv_output[:, :self.h_channels, :] + 
-                          hh_conv_output[:, :self.h_channels, :])
-        r = torch.sigmoid(
-            ih_conv_output[:, self.h_channels:2*self.h_channels, :] + 
-            hh_conv_output[:, self.h_channels:2*self.h_channels, :])
-        n = torch.tanh(ih_conv_output[:, 2*self.h_channels:, :] + 
-                       r * hh_conv_output[:, 2*self.h_channels:, :])
-        return (1 - z) * n + z * hx
+            hx = ih_conv_output.new_zeros((batch, cell.h_channels, 
+                                           ih_conv_output.size(-1)))
+        # Only the hidden->hidden convolution and the gating remain in the time
+        # loop. Split the steps once, as selecting them one by one would 
+        # backpropagate a gradient the size of the whole sequence for every 
+        # step. Collect the hidden states rather than writing them into a 
+        # preallocated output, as every in-place write would clone the full 
+        # output gradient backward
+        outputs = []
+        for ih_step in ih_conv_output.unbind(time_dim):
+            if cell.separable:
+                hh_conv_output = cell.conv_hh(hx)
+            else:
+                hh_conv_output = functional.conv1d(hx, cell.conv_hh.weight, 
+                                                   cell.conv_hh.bias, 
+                                                   padding=cell.conv_hh.padding)
+            hx = _gru_gate(ih_step, hh_conv_output, hx, cell.h_channels)
+            outputs.append(hx)
+        # Stacking along the time dimension gives the output its final layout
+        return torch.stack(outputs, dim=time_dim)
 
 # ------------------------------------------------------------------------------
 # Two-dimensional Convolution Gated Recurrent Unit
@@ -99,7 +522,8 @@ class ConvGRU2DCell(nn.Module):
                  kernel_size: Union[int, tuple], 
                  stride: Union[int, tuple]=(1, 1), 
                  padding: Union[int, tuple]=(0, 0),
-                 recurrent_kernel_size: Union[int, tuple]=(3, 3)):
+                 recurrent_kernel_size: Union[int, tuple]=(3, 3),
+                 separable: bool=False, compiled: bool=False):
         """
         Two-Dimensional Convolutional Gated Recurrent Unit (ConvGRU2D) cell.
         
@@ -109,8 +533,31 @@ class ConvGRU2DCell(nn.Module):
         an odd kernel size in both dimensions, in order to keep the number of 
         features the same.
         
+        When the input-to-hidden convolution is unit-stride and shares the
+        kernel size and padding of the hidden-to-hidden one, both run as a 
+        single convolution on the concatenation of the input and hidden state,
+        as long as neither has more than 8 channels. Wider cells run faster
+        with two convolutions, the fused one computing a block of zeros to
+        keep the reset gate apart.
+
+        With separable set, both convolutions are factorized into a depthwise
+        convolution followed by a pointwise one, which cuts their parameters
+        and multiply-accumulates by roughly the kernel size.
+
+        The next hidden state is returned in the memory format of the input.
+        On CUDA devices, the convolutions and the gating run on channels_last
+        (NHWC) activations, which lets cuDNN pick tensor core kernels, so 
+        channels_last inputs avoid converting back and forth at every step.
+
+        With compiled set, the step is compiled with torch.compile for static
+        shapes the first time it runs, letting Inductor fuse the gating into 
+        the convolution epilogue. Changing the input shape triggers a 
+        recompilation.
+
         The hidden state is initialized by default to a zero tensor of the
-        appropriate shape.
+        appropriate shape. Under torch.autocast, the hidden state follows the 
+        half precision of the convolution outputs, while the parameters stay 
+        in single precision and are cast on demand.
 
         Arguments:
             input_channels {int} -- [Number of channels of the input tensor]
@@ -126,50 +573,153 @@ class ConvGRU2DCell(nn.Module):
             recurrent_kernel_size {int or tuple} -- [Size of the hidden-to-
                                                      -hidden convolving kernel] 
                                                      (default: {(3, 3)})
+            separable {bool} -- [Use depthwise-separable convolutions] 
+                                 (default: {False})
+            compiled {bool} -- [Compile the step with torch.compile on first
+                                use] (default: {False})
         """
         super(ConvGRU2DCell, self).__init__()
 
+        recurrent_kernel_size = _pair(recurrent_kernel_size)
         hh_padding = (recurrent_kernel_size[0] // 2, 
                       recurrent_kernel_size[1] // 2)
         
-        self.conv_ih = nn.Conv2d(input_channels, hidden_channels * 3, 
-                                 kernel_size, stride=stride, padding=padding)
-        self.conv_hh = nn.Conv2d(hidden_channels, hidden_channels * 3, 
-                                 recurrent_kernel_size, stride=1, 
-                                 padding=hh_padding)
+        if separable:
+            self.conv_ih = _separable_conv(nn.Conv2d, input_channels, 
+                                           hidden_channels * 3, kernel_size, 
+                                           stride, padding)
+            self.conv_hh = _separable_conv(nn.Conv2d, hidden_channels, 
+                                           hidden_channels * 3, 
+                                           recurrent_kernel_size, 1, 
+                                           hh_padding)
+        else:
+            self.conv_ih = nn.Conv2d(input_channels, hidden_channels * 3, 
+                                     kernel_size, stride=stride, 
+                                     padding=padding)
+            self.conv_hh = nn.Conv2d(hidden_channels, hidden_channels * 3, 
+                                     recurrent_kernel_size, stride=1, 
+                                     padding=hh_padding)
         self.h_channels = hidden_channels
+        self.separable = separable
+        self.fused = not separable and _can_fuse(self.conv_ih, self.conv_hh)
+        self.compiled = compiled
+        self._compiled_forward = None
+        _release_graph(self)
+        # Cache the input-to-hidden geometry used to size the hidden state
+        conv_ih = self.conv_ih[0] if separable else self.conv_ih
+        self._k, self._p, self._s = \
+            conv_ih.kernel_size, conv_ih.padding, conv_ih.stride
     
         self.reset_parameters()
 
     def reset_parameters(self):
-        init.orthogonal_(self.conv_hh.weight)
-        init.xavier_uniform_(self.conv_ih.weight)
-        init.zeros_(self.conv_hh.bias)
-        init.zeros_(self.conv_ih.bias)
+        if self.separable:
+            for conv in (self.conv_ih, self.conv_hh):
+                init.orthogonal_(conv[0].weight)
+                init.xavier_uniform_(conv[1].weight)
+                init.zeros_(conv[1].bias)
+        else:
+            init.orthogonal_(self.conv_hh.weight)
+            init.xavier_uniform_(self.conv_ih.weight)
+            init.zeros_(self.conv_hh.bias)
+            init.zeros_(self.conv_ih.bias)
     
+    def __getstate__(self):
+        # The compiled step and the captured graph hold on to this instance, 
+        # so copies and pickles drop them and rebuild their own
+        state = super(ConvGRU2DCell, self).__getstate__()
+        state.update(_compiled_forward=None, _graph=None, _static_in=None, 
+                     _static_hx=None, _static_out=None, 
+                     _static_signature=None)
+        return state
+
+    def _apply(self, fn, *args, **kwargs):
+        # Moving or casting the parameters invalidates the captured graph
+        _release_graph(self)
+        return super(ConvGRU2DCell, self)._apply(fn, *args, **kwargs)
+
     # --------------------------------------------------------------------------
     # Processing
     # --------------------------------------------------------------------------
     
+    def capture(self, input, hx, warmup: int=3):
+        """
+        Capture the step into a CUDA graph, replayed by the following calls
+        to get rid of the kernel launch overhead.
+
+        The graph is only replayed for inference calls, with gradients
+        disabled, whose input and hidden state match the shapes, dtypes and
+        devices of the ones given here, with the same input memory format and
+        torch.autocast state as during the capture. Any other call, for 
+        instance with a different batch size, falls back to eager execution.
+
+        The graph reads the parameters from their current storage. Moving or
+        casting the cell, e.g. with .to(), drops the graph, while in-place 
+        updates such as optimizer steps or load_state_dict() are picked up.
+        Assigning new tensors to the parameters is not detected, so capture
+        again afterwards. Copies and pickles of the cell do not keep the graph.
+
+        Arguments:
+            input {torch.Tensor} -- [Example input on a CUDA device]
+            hx {torch.Tensor} -- [Example hidden state on a CUDA device]
+
+        Keyword Arguments:
+            warmup {int} -- [Number of eager steps run before capturing] 
+                             (default: {3})
+        """
+        _capture_graph(self, input, hx, warmup)
+
     def forward(self, input, hx=None):
+        # Replay the captured CUDA graph when the call matches it
+        if self._graph is not None:
+            output = _replay_graph(self, input, hx)
+            if output is not None:
+                return output
+        # Compile the step lazily on first use, as shapes are static
+        if self.compiled:
+            if self._compiled_forward is None:
+                self._compiled_forward = torch.compile(
+                    type(self)._forward_impl, dynamic=False)
+            return self._compiled_forward(self, input, hx)
+        return self._forward_impl(input, hx)
+
+    def _forward_impl(self, input, hx=None):
         output_size = \
-            (int((input.size(-2) - self.conv_ih.kernel_size[0] + 
-             2 * self.conv_ih.padding[0]) / self.conv_ih.stride[0]) + 1, 
-            int((input.size(-1) - self.conv_ih.kernel_size[1] + 
-             2 * self.conv_ih.padding[1]) / self.conv_ih.stride[1]) + 1)
+            ((input.size(-2) - self._k[0] + 2 * self._p[0]) // self._s[0] + 1, 
+             (input.size(-1) - self._k[1] + 2 * self._p[1]) // self._s[1] + 1)
         # Handle the case of no hidden state provided
         if hx is None:
-            hx = torch.zeros(input.size(0), self.h_channels, *output_size, 
-                             device=input.device)
-        # Run the input->hidden and hidden->hidden convolution kernels
-        ih_conv_output = self.conv_ih(input)
-        hh_conv_output = self.conv_hh(hx)
-        # Separate the results and apply Gated Recurrent Unit equations
-        z = torch.sigmoid(ih_conv_output[:, :self.h_channels, :, :] + 
-                          hh_conv_output[:, :self.h_channels, :, :])
-        r = torch.sigmoid(
-            ih_conv_output[:, self.h_channels:2*self.h_channels, :, :] + 
-            hh_conv_output[:, self.h_channels:2*self.h_channels, :, :])
-        n = torch.tanh(ih_conv_output[:, 2*self.h_channels:, :, :] + 
-                       r * hh_conv_output[:, 2*self.h_channels:, :, :])
-        return (1 - z) * n + z * hx
+            hx = input.new_zeros((input.size(0), self.h_channels) + 
+                                 output_size)
+        # Hand the hidden state back in the memory format of the input, but run
+        # the convolutions and the gating on NHWC tensors on CUDA
+        memory_format = torch.contiguous_format
+        if input.is_contiguous(memory_format=torch.channels_last):
+            memory_format = torch.channels_last
+        if input.is_cuda:
+            input = input.contiguous(memory_format=torch.channels_last)
+            hx = hx.contiguous(memory_format=torch.channels_last)
+        # Run both convolutions as a single kernel when their geometry matches
+        if self.fused:
+            weight, bias = _fused_parameters(self.conv_ih, self.conv_hh, 
+                                             self.h_channels)
+            gates = functional.conv2d(torch.cat([input, hx], dim=1), weight, 
+                                      bias, padding=self.conv_hh.padding)
+            hy = _fused_gru_gate(gates, hx, self.h_channels)
+        else:
+            # Run the input->hidden and hidden->hidden convolution kernels, 
+            # going through the functional API to skip the module call 
+            # machinery
+            if self.separable:
+                ih_conv_output = self.conv_ih(input)
+                hh_conv_output = self.conv_hh(hx)
+            else:
+                ih_conv_output = functional.conv2d(
+                    input, self.conv_ih.weight, self.conv_ih.bias, 
+                    stride=self._s, padding=self._p)
+                hh_conv_output = functional.conv2d(
+                    hx, self.conv_hh.weight, self.conv_hh.bias, 
+                    padding=self.conv_hh.padding)
+            # Apply the fused Gated Recurrent Unit equations
+            hy = _gru_gate(ih_conv_output, hh_conv_output, hx, self.h_channels)
+        return hy.contiguous(memory_format=memory_format)
@@ -1,6 +1,8 @@
+import copy
+import io
 import unittest
 import torch
-from convgru import ConvGRU1DCell
+from convgru import ConvGRU1D, ConvGRU1DCell
 
 
 class ConvGRU1DTest(unittest.TestCase):
@@ -106,3 +108,255 @@ class ConvGRU1DTest(unittest.TestCase):
             False)
         # Check the final error is low enough
         self.assertLessEqual(error.item(), 2*10**(-3))
+
+    def test_convgru1d_separable(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = 3
+        padding = 1
+        data = 1 + torch.randn(10, channels, 128)
+        # ----------------------------------------------------------------------
+        # Compare the separable cell to the dense one
+        # ----------------------------------------------------------------------
+        dense = ConvGRU1DCell(channels, channels, kernel_size, padding=padding)
+        cell = ConvGRU1DCell(channels, channels, kernel_size, padding=padding, 
+                             separable=True)
+        self.assertLess(sum(p.numel() for p in cell.parameters()), 
+                        sum(p.numel() for p in dense.parameters()))
+        # Run two steps and backpropagate through them
+        output_data = cell(data, cell(data))
+        self.assertEqual(output_data.size(), data.size())
+        output_data.sum().backward()
+        self.assertIsNotNone(cell.conv_ih[0].weight.grad)
+        self.assertIsNotNone(cell.conv_hh[0].weight.grad)
+
+    def test_convgru1d_fused(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = 3
+        padding = 1
+        data = 1 + torch.randn(10, channels, 128)
+        hidden_state = 2 + torch.randn(10, channels, 128)
+        # ----------------------------------------------------------------------
+        # Check the fused convolution matches the two separate ones
+        # ----------------------------------------------------------------------
+        cell = ConvGRU1DCell(channels, channels, kernel_size, padding=padding)
+        self.assertIs(cell.fused, True)
+        results = []
+        for fused in (True, False):
+            cell.fused = fused
+            cell.zero_grad()
+            output_data = cell(data, cell(data, hidden_state))
+            output_data.pow(2).sum().backward()
+            results.append([output_data] + 
+                           [p.grad.clone() for p in cell.parameters()])
+        for fused_result, result in zip(*results):
+            self.assertLessEqual(
+                torch.max((fused_result - result).abs()), 
+                10**(-5) * max(1.0, result.abs().max().item()))
+        # Wider cells keep the two convolutions
+        cell = ConvGRU1DCell(32, 32, kernel_size, padding=padding)
+        self.assertIs(cell.fused, False)
+
+    def test_convgru1d_sequence(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = 3
+        padding = 1
+        time_steps = 16
+        data = 1 + torch.randn(time_steps, 10, channels, 128)
+        # ----------------------------------------------------------------------
+        # Check the layers match a step-by-step run of their cells
+        # ----------------------------------------------------------------------
+        cgru1d = ConvGRU1D(channels, channels, kernel_size, padding=padding, 
+                           nb_layers=2)
+        output_data, hidden_state = cgru1d(data)
+        hx = [None, None]
+        for step in range(time_steps):
+            hx[0] = cgru1d.cells[0](data[step], hx[0])
+            hx[1] = cgru1d.cells[1](hx[0], hx[1])
+            self.assertLessEqual(
+                torch.max((hx[1] - output_data[step]).abs()), 10**(-5))
+        self.assertLessEqual(
+            torch.max((torch.stack(hx) - hidden_state).abs()), 10**(-5))
+        # Resume from the last hidden states
+        output_data, _ = cgru1d(data[:1], hidden_state)
+        hx[0] = cgru1d.cells[0](data[0], hx[0])
+        hx[1] = cgru1d.cells[1](hx[0], hx[1])
+        self.assertLessEqual(
+            torch.max((hx[1] - output_data[0]).abs()), 10**(-5))
+        # A stack needs at least one layer
+        with self.assertRaises(ValueError):
+            ConvGRU1D(channels, channels, kernel_size, nb_layers=0)
+
+    def test_convgru1d_sequence_backward(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = 3
+        padding = 1
+        time_steps = 16
+        data = 1 + torch.randn(time_steps, 10, channels, 128)
+        # ----------------------------------------------------------------------
+        # Check the layers backpropagate like a step-by-step run of their cell
+        # ----------------------------------------------------------------------
+        for separable in (False, True):
+            cgru1d = ConvGRU1D(channels, channels, kernel_size,
+                               padding=padding, separable=separable)
+            output_data, _ = cgru1d(data)
+            output_data.pow(2).sum().backward()
+            gradients = [p.grad.clone() for p in cgru1d.parameters()]
+            cgru1d.zero_grad()
+            hx = None
+            output_data = []
+            for step in range(time_steps):
+                hx = cgru1d.cells[0](data[step], hx)
+                output_data.append(hx)
+            torch.stack(output_data).pow(2).sum().backward()
+            for gradient, p in zip(gradients, cgru1d.parameters()):
+                self.assertLessEqual(
+                    torch.max((gradient - p.grad).abs()),
+                    10**(-4) * max(1.0, p.grad.abs().max().item()))
+
+    def test_convgru1d_autocast(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = 3
+        padding = 1
+        data = 1 + torch.randn(16, 10, channels, 128)
+        # ----------------------------------------------------------------------
+        # Check the recurrence stays in half precision
+        # ----------------------------------------------------------------------
+        cgru1d = ConvGRU1D(channels, channels, kernel_size, padding=padding)
+        with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+            hidden_state = cgru1d.cells[0](data[0])
+            self.assertEqual(hidden_state.dtype, torch.bfloat16)
+            hidden_state = cgru1d.cells[0](data[1], hidden_state)
+            self.assertEqual(hidden_state.dtype, torch.bfloat16)
+            output_data, _ = cgru1d(data)
+            self.assertEqual(output_data.dtype, torch.bfloat16)
+        self.assertEqual(cgru1d.cells[0].conv_hh.weight.dtype, torch.float32)
+
+    def test_convgru1d_batch_first(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = 3
+        padding = 1
+        data = 1 + torch.randn(16, 10, channels, 128)
+        # ----------------------------------------------------------------------
+        # Check both layouts give the same hidden states
+        # ----------------------------------------------------------------------
+        for separable in (False, True):
+            cgru1d = ConvGRU1D(channels, channels, kernel_size, 
+                               padding=padding, separable=separable)
+            output_data, _ = cgru1d(data)
+            cgru1d.batch_first = True
+            output_data_bf, _ = cgru1d(data.transpose(0, 1))
+            self.assertEqual(output_data_bf.size(), (10, 16, channels, 128))
+            output_data_bf = output_data_bf.transpose(0, 1)
+            self.assertLessEqual(
+                torch.max((output_data - output_data_bf).abs()), 10**(-5))
+
+    def test_convgru1d_compiled(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = 3
+        padding = 1
+        data = 1 + torch.randn(10, channels, 128)
+        # ----------------------------------------------------------------------
+        # Check the compiled cell matches the eager one
+        # ----------------------------------------------------------------------
+        cell = ConvGRU1DCell(channels, channels, kernel_size, padding=padding, 
+                             compiled=True)
+        hidden_state = cell(data)
+        output_data = cell(data, hidden_state)
+        cell.compiled = False
+        self.assertLessEqual(
+            torch.max((cell(data, hidden_state) - output_data).abs()), 
+            10**(-5))
+        # ----------------------------------------------------------------------
+        # Check copies compile against their own weights
+        # ----------------------------------------------------------------------
+        cell.compiled = True
+        cell_copy = copy.deepcopy(cell)
+        torch.nn.init.zeros_(cell_copy.conv_hh.weight)
+        output_data = cell_copy(data, hidden_state)
+        cell_copy.compiled = False
+        self.assertLessEqual(
+            torch.max((cell_copy(data, hidden_state) - output_data).abs()), 
+            10**(-5))
+        self.assertGreater(
+            torch.max((cell(data, hidden_state) - output_data).abs()), 
+            10**(-3))
+        # Pickling drops the compiled step as well
+        buffer = io.BytesIO()
+        torch.save(cell, buffer)
+
+    def test_convgru1d_channels(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        input_channels = 3
+        hidden_channels = 8
+        kernel_size = 3
+        data = 1 + torch.randn(10, input_channels, 128)
+        # ----------------------------------------------------------------------
+        # Check the hidden state goes through the hidden-to-hidden kernel
+        # ----------------------------------------------------------------------
+        for stride, padding in ((1, 1), (2, 0)):
+            cell = ConvGRU1DCell(input_channels, hidden_channels, kernel_size, 
+                                 stride=stride, padding=padding)
+            hidden_state = cell(data)
+            output_data = cell(data, hidden_state)
+            self.assertEqual(output_data.size(), hidden_state.size())
+            self.assertEqual(output_data.size(1), hidden_channels)
+
+    @unittest.skipUnless(torch.cuda.is_available(), "CUDA graphs need a GPU")
+    def test_convgru1d_graph(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = 3
+        padding = 1
+        device = torch.device("cuda:0")
+        data = 1 + torch.randn(10, channels, 128, device=device)
+        hidden_state = 2 + torch.randn(10, channels, 128, device=device)
+        # ----------------------------------------------------------------------
+        # Check the replayed graph matches the eager step
+        # ----------------------------------------------------------------------
+        cell = ConvGRU1DCell(channels, channels, kernel_size, padding=padding)
+        cell.to(device)
+        with torch.no_grad():
+            expected_data = cell(data, hidden_state)
+        cell.capture(data, hidden_state)
+        with torch.no_grad():
+            output_data = cell(data, hidden_state)
+            self.assertLessEqual(
+                torch.max((expected_data - output_data).abs()), 10**(-5))
+            # Other batch sizes fall back to eager execution
+            output_data = cell(data[:5], hidden_state[:5])
+            self.assertEqual(output_data.size(0), 5)
+            # Other autocast states fall back as well
+            with torch.autocast(device_type="cuda", dtype=torch.float16):
+                output_data = cell(data, hidden_state)
+            self.assertEqual(output_data.dtype, torch.float16)
+        # Calls requiring gradients fall back to eager execution too
+        self.assertTrue(cell(data, hidden_state).requires_grad)
+        # Copies and moved cells drop the captured graph
+        self.assertIsNone(copy.deepcopy(cell)._graph)
+        cell.to(device)
+        self.assertIsNone(cell._graph)
@@ -1,6 +1,7 @@
+import copy
 import unittest
 import torch
-from convgru import ConvGRU2DCell
+from convgru import ConvGRU2DCell, _graph_signature
 
 
 class ConvGRU2DTest(unittest.TestCase):
@@ -109,3 +110,181 @@ class ConvGRU2DTest(unittest.TestCase):
             False)
         # Check the final error is low enough
         self.assertLessEqual(error.item(), 5*10**(-2))
+
+    def test_convgru2d_separable(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = (3, 3)
+        padding = (1, 1)
+        data = 1 + torch.randn(5, channels, 64, 64)
+        # ----------------------------------------------------------------------
+        # Compare the separable cell to the dense one
+        # ----------------------------------------------------------------------
+        dense = ConvGRU2DCell(channels, channels, kernel_size, padding=padding)
+        cell = ConvGRU2DCell(channels, channels, kernel_size, padding=padding, 
+                             separable=True)
+        self.assertLess(sum(p.numel() for p in cell.parameters()), 
+                        sum(p.numel() for p in dense.parameters()))
+        # Run two steps and backpropagate through them
+        output_data = cell(data, cell(data))
+        self.assertEqual(output_data.size(), data.size())
+        output_data.sum().backward()
+        self.assertIsNotNone(cell.conv_ih[0].weight.grad)
+        self.assertIsNotNone(cell.conv_hh[0].weight.grad)
+
+    def test_convgru2d_fused(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = (3, 3)
+        padding = (1, 1)
+        data = 1 + torch.randn(5, channels, 32, 32)
+        hidden_state = 2 + torch.randn(5, channels, 32, 32)
+        # ----------------------------------------------------------------------
+        # Check the fused convolution matches the two separate ones
+        # ----------------------------------------------------------------------
+        cell = ConvGRU2DCell(channels, channels, kernel_size, padding=padding)
+        self.assertIs(cell.fused, True)
+        results = []
+        for fused in (True, False):
+            cell.fused = fused
+            cell.zero_grad()
+            output_data = cell(data, cell(data, hidden_state))
+            output_data.pow(2).sum().backward()
+            results.append([output_data] + 
+                           [p.grad.clone() for p in cell.parameters()])
+        for fused_result, result in zip(*results):
+            self.assertLessEqual(
+                torch.max((fused_result - result).abs()), 
+                10**(-5) * max(1.0, result.abs().max().item()))
+        # Wider cells keep the two convolutions
+        cell = ConvGRU2DCell(32, 32, kernel_size, padding=padding)
+        self.assertIs(cell.fused, False)
+
+    def test_convgru2d_autocast(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = (3, 3)
+        padding = (1, 1)
+        data = 1 + torch.randn(5, channels, 64, 64)
+        # ----------------------------------------------------------------------
+        # Check the recurrence stays in half precision
+        # ----------------------------------------------------------------------
+        cell = ConvGRU2DCell(channels, channels, kernel_size, padding=padding)
+        with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+            hidden_state = cell(data)
+            self.assertEqual(hidden_state.dtype, torch.bfloat16)
+            hidden_state = cell(data, hidden_state)
+            self.assertEqual(hidden_state.dtype, torch.bfloat16)
+        self.assertEqual(cell.conv_hh.weight.dtype, torch.float32)
+
+    def test_convgru2d_memory_format(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = (3, 3)
+        padding = (1, 1)
+        devices = [torch.device("cpu")]
+        if torch.cuda.is_available():
+            devices.append(torch.device("cuda:0"))
+        # ----------------------------------------------------------------------
+        # Check the hidden state follows the memory format of the input
+        # ----------------------------------------------------------------------
+        for device in devices:
+            data = 1 + torch.randn(5, channels, 64, 64, device=device)
+            cell = ConvGRU2DCell(channels, channels, kernel_size, 
+                                 padding=padding).to(device)
+            hidden_state = cell(data, cell(data))
+            self.assertTrue(hidden_state.is_contiguous())
+            self.assertEqual(hidden_state.view(5, -1).size(1), 
+                             channels * 64 * 64)
+            data = data.contiguous(memory_format=torch.channels_last)
+            hidden_state = cell(data, hidden_state)
+            self.assertTrue(hidden_state.is_contiguous(
+                memory_format=torch.channels_last))
+        # ----------------------------------------------------------------------
+        # Check reset_parameters() keeps the weights in place
+        # ----------------------------------------------------------------------
+        weight_ptr = cell.conv_hh.weight.data_ptr()
+        cell.reset_parameters()
+        self.assertEqual(cell.conv_hh.weight.data_ptr(), weight_ptr)
+
+    @unittest.skipUnless(torch.cuda.is_available(), "CUDA graphs need a GPU")
+    def test_convgru2d_graph(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        kernel_size = (3, 3)
+        padding = (1, 1)
+        device = torch.device("cuda:0")
+        data = 1 + torch.randn(5, channels, 64, 64, device=device)
+        hidden_state = 2 + torch.randn(5, channels, 64, 64, device=device)
+        # ----------------------------------------------------------------------
+        # Check the replayed graph matches the eager step
+        # ----------------------------------------------------------------------
+        cell = ConvGRU2DCell(channels, channels, kernel_size, padding=padding)
+        cell.to(device)
+        with torch.no_grad():
+            expected_data = cell(data, hidden_state)
+        cell.capture(data, hidden_state)
+        with torch.no_grad():
+            output_data = cell(data, hidden_state)
+            self.assertLessEqual(
+                torch.max((expected_data - output_data).abs()), 10**(-5))
+            # Other batch sizes fall back to eager execution
+            output_data = cell(data[:2], hidden_state[:2])
+            self.assertEqual(output_data.size(0), 2)
+            # In-place parameter updates are picked up by the graph
+            cell.reset_parameters()
+            expected_data = cell._forward_impl(data, hidden_state)
+            output_data = cell(data, hidden_state)
+            self.assertLessEqual(
+                torch.max((expected_data - output_data).abs()), 10**(-5))
+            # Other memory formats and autocast states fall back as well
+            output_data = cell(
+                data.contiguous(memory_format=torch.channels_last), 
+                hidden_state)
+            self.assertTrue(output_data.is_contiguous(
+                memory_format=torch.channels_last))
+            with torch.autocast(device_type="cuda", dtype=torch.float16):
+                output_data = cell(data, hidden_state)
+            self.assertEqual(output_data.dtype, torch.float16)
+        # Calls requiring gradients fall back to eager execution too
+        self.assertTrue(cell(data, hidden_state).requires_grad)
+        # Copies and moved cells drop the captured graph
+        self.assertIsNone(copy.deepcopy(cell)._graph)
+        cell.to(device)
+        self.assertIsNone(cell._graph)
+
+    def test_convgru2d_graph_signature(self):
+        # ----------------------------------------------------------------------
+        # Data preparation
+        # ----------------------------------------------------------------------
+        channels = 8
+        data = 1 + torch.randn(5, channels, 64, 64)
+        hidden_state = 2 + torch.randn(5, channels, 64, 64)
+        signature = _graph_signature(data, hidden_state)
+        # ----------------------------------------------------------------------
+        # Check the calls a captured graph cannot replay are told apart
+        # ----------------------------------------------------------------------
+        self.assertEqual(_graph_signature(data.clone(), hidden_state), 
+                         signature)
+        self.assertNotEqual(_graph_signature(data[:2], hidden_state[:2]), 
+                            signature)
+        self.assertNotEqual(_graph_signature(
+            data.contiguous(memory_format=torch.channels_last), hidden_state), 
+            signature)
+        with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+            self.assertNotEqual(_graph_signature(data, hidden_state), 
+                                signature)
+            autocast_signature = _graph_signature(data, hidden_state)
+        with torch.autocast(device_type="cpu", dtype=torch.float16):
+            self.assertNotEqual(_graph_signature(data, hidden_state), 
+                                autocast_signature)